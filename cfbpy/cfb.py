@@ -1,6 +1,8 @@
-from olefile import OleFileIO
-import os, struct
-import math
+import os, struct, sys
+import array
+import contextlib
+import mmap
+from concurrent.futures import ThreadPoolExecutor
 
 from . import directory
 
@@ -11,6 +13,7 @@ MAJOR_VERSION = 0x0003
 BYTE_ORDER = 0xFFFE
 MINI_SECTOR_SHIFT = 0x0006
 MINI_STREAM_CUTOFF_SIZE = 0x00001000
+NUM_HEADER_DIFAT = 109  #: number of difat entries held in header
 
 # Sector constants
 MAXREGSECT = 0xFFFFFFFA  #: (-6) maximum SECT
@@ -19,6 +22,214 @@ FATSECT = 0xFFFFFFFD  #: (-3) denotes a FAT sector in a FAT
 ENDOFCHAIN = 0xFFFFFFFE  #: (-2) end of a virtual stream chain
 FREESECT = 0xFFFFFFFF  #: (-1) unallocated sector
 
+# Precompiled struct format of header
+_HEADER = struct.Struct("<8s16xHHHHH6xIIIIIIIII")
+
+# Number of small streams from which they are read ahead on thread pool
+_READ_AHEAD_MIN_STREAMS = 64
+
+
+def _count_sectors(size, shift):
+    """
+    Count sectors of `1 << shift` bytes needed to hold `size` bytes.
+
+    """
+
+    return (size + (1 << shift) - 1) >> shift
+
+
+def _count_fat_sectors(num_sectors, shift):
+    """
+    Count fat and difat sectors needed for `num_sectors` other sectors of `1 << shift` bytes.
+
+    Fat also covers its own sectors and difat sectors, so counts are grown until they settle. Every difat sector lists fat sectors beyond header except its last entry, which chains to next difat sector.
+
+    """
+
+    entries_per_difat_sector = (1 << (shift - 2)) - 1
+    num_fat_sectors = num_difat_sectors = 0
+
+    while True:
+        fat_sectors = _count_sectors(
+            4 * (num_sectors + num_fat_sectors + num_difat_sectors),
+            shift,
+        )
+        difat_sectors = -(
+            -max(fat_sectors - NUM_HEADER_DIFAT, 0) // entries_per_difat_sector
+        )
+
+        # Stop once counts cover sectors counted including themselves
+        counts = fat_sectors, difat_sectors
+
+        if counts == (num_fat_sectors, num_difat_sectors):
+            return counts
+
+        num_fat_sectors, num_difat_sectors = fat_sectors, difat_sectors
+
+
+def _read_file(path):
+    """
+    Read whole data of file at `path`.
+
+    """
+
+    with open(path, "rb", buffering=0) as f:
+        return f.read()
+
+
+def _pack_entries(entries: array.array) -> bytes:
+    """
+    Pack array of sector numbers as little-endian u32 byte sequence.
+
+    """
+
+    if sys.byteorder == "little":
+        return entries.tobytes()
+
+    # Swap copy of entries on big-endian hosts
+    swapped = array.array("I", entries)
+    swapped.byteswap()
+
+    return swapped.tobytes()
+
+
+def _unpack_entries(data) -> array.array:
+    """
+    Unpack little-endian u32 byte sequence as array of sector numbers.
+
+    """
+
+    entries = array.array("I")
+    entries.frombytes(data)
+
+    # Swap entries on big-endian hosts
+    if sys.byteorder != "little":
+        entries.byteswap()
+
+    return entries
+
+
+def _read_chain(fat: array.array, sector):
+    """
+    Yield sector numbers of chain starting at `sector` in `fat`.
+
+    Chain is never followed longer than `fat` itself, so looped chain of broken file does not hang.
+
+    """
+
+    for _ in range(len(fat)):
+        if sector > MAXREGSECT:
+            return
+
+        # Sector not covered by fat lies beyond end of file
+        if sector >= len(fat):
+            raise Exception("Stream runs past end of compound file")
+
+        yield sector
+        sector = fat[sector]
+
+
+def _chain_views(buffer, offsets, unit, size):
+    """
+    Yield views of `buffer` covering `size` bytes of stream laid on units of `unit` bytes at `offsets`.
+
+    Adjacent units are merged into single view, so contiguous stream is yielded as a whole. Raises if stream runs past its chain or `buffer`.
+
+    """
+
+    start = end = None
+
+    for offset in offsets:
+        if size <= 0:
+            break
+
+        length = min(unit, size)
+        size -= length
+
+        # Extend current view if unit follows right after it
+        if offset == end:
+            end += length
+            continue
+
+        if start is not None:
+            yield buffer[start:end]
+
+        start, end = offset, offset + length
+
+        if end > len(buffer):
+            raise Exception("Stream runs past end of compound file")
+
+    if size > 0:
+        raise Exception("Stream is longer than its sector chain")
+
+    if start is not None:
+        yield buffer[start:end]
+
+
+def _write_all(fp, buffers):
+    """
+    Write every buffer to unbuffered file object `fp` in order.
+
+    Uses single vectored write where `os.writev` is available and retries on short writes.
+
+    """
+
+    views = [memoryview(buffer) for buffer in buffers]
+
+    try:
+        while views:
+            if hasattr(os, "writev"):
+                written = os.writev(fp.fileno(), views)
+
+            else:
+                written = fp.write(views[0])
+
+            # Drop buffers fully written and trim buffer partially written
+            while views and written >= len(views[0]):
+                written -= len(views.pop(0))
+
+            if views:
+                views[0] = views[0][written:]
+
+    # Release views left on error, as traceback keeps them alive otherwise
+    finally:
+        for view in views:
+            view.release()
+
+
+def _scan_tree(src):
+    """
+    Walk directory tree top-down using `os.scandir`.
+
+    Yields storage path relative to `src` (blank for root) and list of `os.DirEntry` of files in the storage.
+
+    """
+
+    stack = [("", src)]
+
+    while stack:
+        storage, root = stack.pop()
+        streams, storages = [], []
+
+        with os.scandir(root) as entries:
+            for entry in entries:
+                if entry.is_dir():
+                    storages.append(entry)
+
+                else:
+                    streams.append(entry)
+
+        yield storage, streams
+
+        # Push storages reversed to visit them in scan order
+        for entry in reversed(storages):
+            # Do not follow symbolic links to directories
+            if entry.is_symlink():
+                continue
+
+            child = f"{storage}/{entry.name}" if storage else entry.name
+            stack.append((child, entry.path))
+
 
 class CompoundFile:
     def __init__(self) -> None:
@@ -33,6 +244,8 @@ class CompoundFile:
         self.byte_order = BYTE_ORDER
         self.sector_shift = 0x0009 if self.major_version == 0x0003 else 0x000C
         self.mini_sector_shift = MINI_SECTOR_SHIFT
+        self.sector_size = 1 << self.sector_shift
+        self.mini_sector_size = 1 << self.mini_sector_shift
         self.num_dir_sectors = 0
         self.num_fat_sectors = 0
         self.first_dir_sector = 0
@@ -44,13 +257,17 @@ class CompoundFile:
         self.num_difat_sectors = 0
 
         # File Allocation Table (FAT)
-        self.fat = []
-        self.mini_fat = []
-        self.difat = []
+        self.fat = array.array("I")
+        self.mini_fat = array.array("I")
+        self.difat = array.array("I")
 
         # Sector data
-        self.sectors = []
-        self.mini_sectors = []
+        self.sectors = bytearray()  # May be reserved beyond written sectors
+        self.num_sectors = 0  # Number of sectors written into `sectors`
+        self.mini_sectors = bytearray()
+
+        # Zero-filled mini sector, sliced for padding without copy
+        self._zero_mini_sector = memoryview(bytes(self.mini_sector_size))
 
         # Directories
         self.root_directory = directory.Directory()
@@ -99,13 +316,36 @@ class CompoundFile:
         if (entry := self.search_directory(path)) is None:
             raise Exception(f"Given path not found: {path}")
 
+        return self.insert_entry(entry, data)
+
+    def insert_entry(self, entry: directory.Entry, data: directory.EntryData):
+        """
+        Insert new entry as child of given entry.
+
+        Returns inserted entry, so that it can be used as parent of other entries without searching path again.
+
+        """
+
         # Update entry data
         data.stream_id = self.num_dir
         data.parent = entry
+        self.num_dir += 1
 
         # Insert new entry as child of parent entry
-        entry.data.child.insert(data)
-        self.num_dir += 1
+        return entry.data.child.insert(data)
+
+    def reserve_sectors(self, num_sectors):
+        """
+        Reserve room in sector buffer for `num_sectors` sectors after written ones.
+
+        Reserved room is zero-filled and written in place, so writing into it neither regrows buffer nor needs padding.
+
+        """
+
+        size = (self.num_sectors + num_sectors) * self.sector_size
+
+        if size > len(self.sectors):
+            self.sectors.extend(bytes(size - len(self.sectors)))
 
     def write_sector(self, data: bytes):
         """
@@ -117,25 +357,95 @@ class CompoundFile:
         sector_index = len(self.fat)
 
         # Get sector size
-        sector_size = 1 << self.sector_shift
+        sector_size = self.sector_size
 
-        # Separate data into head/tail
-        head, tail = data[:sector_size], data[sector_size:]
+        # Get number of sectors for data (empty stream takes one sector)
+        num_sectors = max(_count_sectors(len(data), self.sector_shift), 1)
 
-        # Write head to sector right before last head
-        while tail:
-            self.sectors.append(head)
-            self.fat.append(len(self.sectors))
+        # Write data to contiguous sectors (rest of last sector stays zero)
+        offset = self.num_sectors * sector_size
 
-            head, tail = tail[:sector_size], tail[sector_size:]
+        self.reserve_sectors(num_sectors)
+        self.sectors[offset : offset + len(data)] = data
+        self.num_sectors += num_sectors
 
-        # Write last head to sector and end FAT chain
-        self.sectors.append(struct.pack(f"<{sector_size}s", head))
+        # Chain each sector to the next one and end FAT chain
+        self.fat.extend(range(sector_index + 1, sector_index + num_sectors))
         self.fat.append(ENDOFCHAIN)
 
         # Return first sector number of stream
         return sector_index
 
+    def write_sector_from_file(self, fp):
+        """
+        Write data stream read from file object to the sector.
+
+        Stream is read in chunks of sector multiple straight into sector buffer, so it is never held in memory as a whole nor copied.
+
+        Returns first sector number and size of stream read.
+
+        """
+
+        # Get sector index for data
+        sector_index = len(self.fat)
+
+        # Get sector size and number of sectors in chunk
+        sector_size = self.sector_size
+        chunk_sectors = (1 << 20) // sector_size
+
+        # Bind method used in loop locally
+        readinto = fp.readinto
+
+        # Read data in chunks into contiguous sectors
+        offset = self.num_sectors * sector_size
+        size = 0
+
+        while True:
+            start = offset + size
+
+            # Reserve room for next chunk only when reserved room is filled
+            if start >= len(self.sectors):
+                self.reserve_sectors(size // sector_size + chunk_sectors)
+
+            # Read at most up to end of reserved room.
+            # Release view before buffer may be regrown by next reservation.
+            with memoryview(self.sectors) as view:
+                length = readinto(view[start : start + (1 << 20)])
+
+            if not length:
+                break
+
+            size += length
+
+        # Get number of sectors for data (empty stream takes one sector)
+        num_sectors = max(_count_sectors(size, self.sector_shift), 1)
+
+        # Rest of last sector stays zero as reserved
+        self.num_sectors += num_sectors
+
+        # Chain each sector to the next one and end FAT chain
+        self.fat.extend(range(sector_index + 1, sector_index + num_sectors))
+        self.fat.append(ENDOFCHAIN)
+
+        # Return first sector number and size of stream
+        return sector_index, size
+
+    def discard_sectors(self, sector_index):
+        """
+        Discard sectors written from `sector_index` on.
+
+        Room of discarded sectors is zero-filled again and stays reserved.
+
+        """
+
+        offset = sector_index * self.sector_size
+        end = self.num_sectors * self.sector_size
+
+        self.sectors[offset:end] = bytes(end - offset)
+        self.num_sectors = sector_index
+
+        del self.fat[sector_index:]
+
     def write_mini_sector(self, data: bytes):
         """
         Write mini data stream to the sector.
@@ -146,45 +456,106 @@ class CompoundFile:
         sector_index = len(self.mini_fat)
 
         # Get mini sector size
-        mini_sector_size = 1 << self.mini_sector_shift
+        mini_sector_size = self.mini_sector_size
 
-        # Separate data into head/tail
-        head, tail = data[:mini_sector_size], data[mini_sector_size:]
+        # Get number of mini sectors for data (empty stream takes one sector)
+        num_sectors = max(_count_sectors(len(data), self.mini_sector_shift), 1)
 
-        # Write head to sector right before last head
-        while tail:
-            self.mini_sectors.append(head)
-            self.mini_fat.append(len(self.mini_sectors))
+        # Write data to contiguous mini sectors padded with zero
+        padding = num_sectors * mini_sector_size - len(data)
 
-            head, tail = tail[:mini_sector_size], tail[mini_sector_size:]
+        self.mini_sectors.extend(data)
+        self.mini_sectors.extend(self._zero_mini_sector[:padding])
 
-        # Write last head to sector and end MINIFAT chain
-        self.mini_sectors.append(
-            struct.pack(f"<{mini_sector_size}s", head),
+        # Chain each mini sector to the next one and end MINIFAT chain
+        self.mini_fat.extend(
+            range(sector_index + 1, sector_index + num_sectors),
         )
         self.mini_fat.append(ENDOFCHAIN)
 
         # Return first sector number of stream
         return sector_index
 
-    def write_fat(self, data: bytes):
+    def write_table(self, data: bytes):
+        """
+        Write table data to contiguous sectors without chaining them in fat.
+
+        """
+
+        # Get first sector index and number of sectors for table
+        sector_index = self.num_sectors
+        num_sectors = _count_sectors(len(data), self.sector_shift)
+
+        # Write table to contiguous sectors (rest of last sector stays zero)
+        offset = sector_index * self.sector_size
+
+        self.reserve_sectors(num_sectors)
+        self.sectors[offset : offset + len(data)] = data
+        self.num_sectors += num_sectors
+
+        # Return first sector number of table
+        return sector_index
+
+    def write_fat(self):
         """
         Write fat to the sector and write difat array.
 
+        Fat sectors past the first 109 are listed in chain of difat sectors written right after fat.
+
         """
 
-        # Get sector size
-        sector_size = 1 << self.sector_shift
+        # Get number of fat and difat sectors following written sectors
+        num_fat_sectors, num_difat_sectors = _count_fat_sectors(
+            self.num_sectors,
+            self.sector_shift,
+        )
+        first_fat_sector = self.num_sectors
+        first_difat_sector = first_fat_sector + num_fat_sectors
+
+        # Mark fat and difat sectors, and leave rest of fat sectors free
+        self.fat.extend([FATSECT] * num_fat_sectors)
+        self.fat.extend([DIFSECT] * num_difat_sectors)
+        self.fat.extend(
+            [FREESECT]
+            * ((num_fat_sectors << (self.sector_shift - 2)) - len(self.fat)),
+        )
+
+        self.write_table(_pack_entries(self.fat))
+        self.num_fat_sectors = num_fat_sectors
 
-        # Separate data into head/tail
-        head, tail = data[:sector_size], data[sector_size:]
+        # Register every fat sector in difat array
+        self.difat.extend(
+            range(first_fat_sector, first_fat_sector + num_fat_sectors),
+        )
 
-        # Write head to sector until there is no head left
-        while head:
-            self.difat.append(len(self.sectors))
-            self.sectors.append(struct.pack(f"<{sector_size}s", head))
+        # List fat sectors beyond header in difat sectors
+        entries_per_sector = (1 << (self.sector_shift - 2)) - 1
+        difat_sectors = array.array("I")
 
-            head, tail = tail[:sector_size], tail[sector_size:]
+        for index in range(num_difat_sectors):
+            start = NUM_HEADER_DIFAT + index * entries_per_sector
+            entries = self.difat[start : start + entries_per_sector]
+
+            difat_sectors.extend(entries)
+            difat_sectors.extend(
+                [FREESECT] * (entries_per_sector - len(entries)),
+            )
+
+            # Chain to next difat sector or end chain at last one
+            if index + 1 < num_difat_sectors:
+                difat_sectors.append(first_difat_sector + index + 1)
+
+            else:
+                difat_sectors.append(ENDOFCHAIN)
+
+        if num_difat_sectors:
+            self.write_table(_pack_entries(difat_sectors))
+            self.first_difat_sector = first_difat_sector
+
+        else:
+            self.first_difat_sector = ENDOFCHAIN
+
+        self.num_difat_sectors = num_difat_sectors
 
     def open(self, src):
         """
@@ -200,9 +571,15 @@ class CompoundFile:
 
         """
 
-        # Write header sector
-        header_data = struct.pack(
-            "<8s16xHHHHH6xIIIIIIIII",
+        # Prepare header sector with unused difat entries set to FREESECT
+        header_sector = bytearray(b"\xff") * (
+            _HEADER.size + 4 * NUM_HEADER_DIFAT
+        )
+
+        # Write header into header sector
+        _HEADER.pack_into(
+            header_sector,
+            0,
             self.header_signature,
             self.minor_version,
             self.major_version,
@@ -220,21 +597,21 @@ class CompoundFile:
             self.num_difat_sectors,
         )
 
-        # Open file path to save data
-        with open(dest, "wb") as fp:
-            # Write header
-            fp.write(header_data)
+        # Write difat right after header, rest is in difat sectors
+        difat_data = _pack_entries(self.difat[:NUM_HEADER_DIFAT])
+        header_sector[_HEADER.size : _HEADER.size + len(difat_data)] = difat_data
 
-            # Write difat
-            for entry in self.difat:
-                fp.write(struct.pack("<I", entry))
+        # Get written sectors
+        sectors = memoryview(self.sectors)[: self.num_sectors * self.sector_size]
 
-            # Patch rest of difat entry
-            for _ in range(109 - len(self.difat)):
-                fp.write(struct.pack("<I", 0xFFFFFFFF))
+        # Open file path to save data without user-space buffering
+        with open(dest, "wb", buffering=0) as fp:
+            # Write header sector and sectors at once
+            _write_all(fp, [header_sector, sectors])
 
-            # Write sectors
-            fp.write(b"".join(self.sectors))
+            # Hint that written pages need not stay in page cache
+            if hasattr(os, "posix_fadvise"):
+                os.posix_fadvise(fp.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
 
     @staticmethod
     def decompress(src, dest=None):
@@ -249,27 +626,194 @@ class CompoundFile:
 
         os.makedirs(dest, exist_ok=True)
 
-        # Open compound file
-        olefile = OleFileIO(src)
-
-        # Iterate every stream in compound file
-        for *storage_path, stream_path in olefile.listdir():
-            # Create storge as directory
-            full_path = dest + "/" + "/".join(storage_path)
-            os.makedirs(full_path, exist_ok=True)
+        # Map compound file so that streams are written straight from it
+        with (
+            open(src, "rb", buffering=0) as f,
+            mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm,
+        ):
+            buffer = memoryview(mm)
 
-            # Read stream and export as file
-            real_path = full_path + "/" + stream_path
+            try:
+                CompoundFile._extract(buffer, dest)
 
-            with open(real_path, "wb") as f:
-                data_path = "/".join(storage_path + [stream_path])
-                data = olefile.openstream(data_path).read()
-
-                f.write(data)
+            # Release view before mapping is closed
+            finally:
+                buffer.release()
 
         # Return True if decompressed successfully
         return True
 
+    @staticmethod
+    def _extract(buffer, dest):
+        """
+        Parse compound file mapped in `buffer` and export its storages and streams under `dest`.
+
+        """
+
+        # Compound file holds at least its header sector
+        if len(buffer) < 512:
+            raise Exception("Given file is not a compound file")
+
+        (
+            signature,
+            _,
+            major_version,
+            _,
+            sector_shift,
+            mini_sector_shift,
+            _,
+            num_fat_sectors,
+            first_dir_sector,
+            _,
+            mini_stream_cutoff_size,
+            first_mini_fat_sector,
+            _,
+            first_difat_sector,
+            num_difat_sectors,
+        ) = _HEADER.unpack_from(buffer, 0)
+
+        if (
+            signature != HEADER_SIGNATURE
+            or sector_shift not in (0x0009, 0x000C)
+            or not 0 < mini_sector_shift < sector_shift
+        ):
+            raise Exception("Given file is not a compound file")
+
+        sector_size = 1 << sector_shift
+        mini_sector_size = 1 << mini_sector_shift
+
+        # Sector N starts right after header sector
+        def sector_offsets(sectors):
+            return ((sector + 1) << sector_shift for sector in sectors)
+
+        # Read table of sector numbers held in whole sectors within file
+        def read_table(sectors):
+            table = array.array("I")
+
+            for offset in sector_offsets(sectors):
+                if offset + sector_size > len(buffer):
+                    raise Exception("Stream runs past end of compound file")
+
+                table.extend(
+                    _unpack_entries(buffer[offset : offset + sector_size]),
+                )
+
+            return table
+
+        # Collect fat sectors from header and difat sector chain
+        difat = _unpack_entries(
+            buffer[_HEADER.size : _HEADER.size + 4 * NUM_HEADER_DIFAT],
+        )
+        difat_sector = first_difat_sector
+
+        for _ in range(num_difat_sectors):
+            if difat_sector > MAXREGSECT:
+                break
+
+            # Last entry of difat sector chains to next difat sector
+            entries = read_table([difat_sector])
+            difat_sector = entries.pop()
+            difat.extend(entries)
+
+        # Read fat and mini fat from their sectors
+        fat = read_table(difat[:num_fat_sectors])
+        mini_fat = read_table(_read_chain(fat, first_mini_fat_sector))
+
+        # Locate directory entry by stream ID within directory sector chain
+        dir_offsets = list(sector_offsets(_read_chain(fat, first_dir_sector)))
+        entries_per_sector = sector_size // directory.ENTRY_SIZE
+
+        def read_entry(stream_id):
+            sector, index = divmod(stream_id, entries_per_sector)
+
+            if sector >= len(dir_offsets):
+                raise Exception("Stream ID runs past end of directory")
+
+            entry = directory.unpack_entry(
+                buffer,
+                dir_offsets[sector] + index * directory.ENTRY_SIZE,
+            )
+
+            # Upper half of stream size may be garbage in version 3 file
+            if major_version == 0x0003:
+                entry = (*entry[:-1], entry[-1] & 0xFFFFFFFF)
+
+            return entry
+
+        # Mini stream is held in sector chain starting from root entry
+        *_, root_child, mini_stream_sector, _ = read_entry(0)
+        mini_stream_offsets = list(
+            sector_offsets(_read_chain(fat, mini_stream_sector)),
+        )
+
+        # Mini sector never crosses sector as sector size is its multiple
+        def mini_sector_offsets(mini_sectors):
+            for mini_sector in mini_sectors:
+                sector, offset = divmod(
+                    mini_sector << mini_sector_shift,
+                    sector_size,
+                )
+
+                if sector >= len(mini_stream_offsets):
+                    raise Exception("Stream is longer than its sector chain")
+
+                yield mini_stream_offsets[sector] + offset
+
+        # Walk directory tree with stack of stream ID and path of its storage
+        stack = [(root_child, dest)]
+        visited = set()
+
+        while stack:
+            stream_id, path = stack.pop()
+
+            # Skip unallocated entry and entry of looped tree already visited
+            if stream_id > directory.MAXREGSID or stream_id in visited:
+                continue
+
+            visited.add(stream_id)
+            name, obj_type, left, right, child, sector, size = read_entry(
+                stream_id,
+            )
+
+            # Siblings share storage of entry
+            stack.append((right, path))
+            stack.append((left, path))
+
+            # Skip name which would escape storage
+            if name in ("", ".", "..") or "/" in name or os.sep in name:
+                continue
+
+            real_path = os.path.join(path, name)
+
+            # Create storage as directory
+            if obj_type == directory.OBJTY_STORAGE:
+                os.makedirs(real_path, exist_ok=True)
+                stack.append((child, real_path))
+
+            # Export stream as file from mini stream or sectors
+            elif obj_type == directory.OBJTY_STREAM:
+                if size < mini_stream_cutoff_size:
+                    views = _chain_views(
+                        buffer,
+                        mini_sector_offsets(_read_chain(mini_fat, sector)),
+                        mini_sector_size,
+                        size,
+                    )
+
+                else:
+                    views = _chain_views(
+                        buffer,
+                        sector_offsets(_read_chain(fat, sector)),
+                        sector_size,
+                        size,
+                    )
+
+                with open(real_path, "wb", buffering=0) as fp:
+                    for view in views:
+                        # Release view of mapping even if writing it fails
+                        with view:
+                            _write_all(fp, [view])
+
     @staticmethod
     def compress(src, dest=None):
         """
@@ -282,85 +826,179 @@ class CompoundFile:
         if not dest:
             dest = f"{src}.cfb"
 
-        for root, _, streams in os.walk(src):
-            storage = os.path.relpath(root, src).lstrip(".")
+        # Collect directory tree first so that sectors can be reserved
+        tree = list(_scan_tree(src))
 
-            # Add storage as directory entry is storage is not a root
-            if storage:
-                *path, storage_name = storage.split("/")
+        # Count sectors of large streams and mini-sectors of small streams
+        num_sectors = num_mini_sectors = 0
 
-                # Insert storage into directory
-                cfb.insert_directory(
-                    "/".join(path),
-                    directory.EntryData(
-                        name=storage_name,
-                        obj_type=directory.OBJTY_STORAGE,
-                    ),
-                )
+        # Count directory entries of root, storages and streams
+        num_entries = len(tree)
+        small_paths = []
+
+        for _, streams in tree:
+            num_entries += len(streams)
 
             for stream in streams:
-                # Read data from file
-                with open(f"{root}/{stream}", "rb") as f:
-                    stream_data = f.read()
-                    stream_size = len(stream_data)
+                stream_size = stream.stat().st_size
 
-                # Write data into sector or mini-sector
-                if stream_size > MINI_STREAM_CUTOFF_SIZE:
-                    stream_sector_index = cfb.write_sector(stream_data)
+                if stream_size >= MINI_STREAM_CUTOFF_SIZE:
+                    num_sectors += _count_sectors(
+                        stream_size,
+                        cfb.sector_shift,
+                    )
 
                 else:
-                    stream_sector_index = cfb.write_mini_sector(stream_data)
-
-                # Insert stream into directory
-                cfb.insert_directory(
-                    storage,
-                    directory.EntryData(
-                        name=stream,
-                        obj_type=directory.OBJTY_STREAM,
-                        sector=stream_sector_index,
-                        size=stream_size,
-                    ),
-                )
+                    small_paths.append(stream.path)
+                    num_mini_sectors += max(
+                        _count_sectors(stream_size, cfb.mini_sector_shift),
+                        1,
+                    )
+
+        # Count sectors of mini stream, mini-fat and directory
+        num_sectors += max(
+            _count_sectors(
+                num_mini_sectors << cfb.mini_sector_shift,
+                cfb.sector_shift,
+            ),
+            1,
+        )
+        num_sectors += max(
+            _count_sectors(4 * num_mini_sectors, cfb.sector_shift),
+            1,
+        )
+        num_sectors += _count_sectors(
+            (num_entries + 3) // 4 * 4 * directory.ENTRY_SIZE,
+            cfb.sector_shift,
+        )
 
-        # Write mini-sector into sector
-        mini_sector_data = b"".join(cfb.mini_sectors)
-        mini_sector_index = cfb.write_sector(mini_sector_data)
+        # Count sectors of fat and difat, as fat covers every sector
+        num_sectors += sum(_count_fat_sectors(num_sectors, cfb.sector_shift))
 
-        cfb.root_directory.root.data.size = len(mini_sector_data)
-        cfb.root_directory.root.data.sector = mini_sector_index
+        # Reserve every sector up front so that buffer is never regrown
+        cfb.reserve_sectors(num_sectors)
 
-        # Get sector size
-        sector_size = 1 << cfb.sector_shift
+        # Read small streams ahead on thread pool only where reads can run
+        # in parallel, as pool is slower than reading in place on single CPU
+        num_workers = min(8, os.cpu_count() or 1)
+
+        with contextlib.ExitStack() as stack:
+            if num_workers > 1 and len(small_paths) >= _READ_AHEAD_MIN_STREAMS:
+                executor = stack.enter_context(
+                    ThreadPoolExecutor(max_workers=num_workers),
+                )
+                small_data = executor.map(_read_file, small_paths)
+
+            else:
+                small_data = map(_read_file, small_paths)
+
+            # Cache entry of every storage inserted by its path
+            storage_entries = {"": cfb.root_directory.root}
+
+            for storage, streams in tree:
+                # Add storage as directory entry is storage is not a root
+                if storage:
+                    path, _, storage_name = storage.rpartition("/")
+
+                    # Insert storage into directory under cached parent
+                    storage_entries[storage] = cfb.insert_entry(
+                        storage_entries[path],
+                        directory.EntryData(
+                            name=storage_name,
+                            obj_type=directory.OBJTY_STORAGE,
+                        ),
+                    )
+
+                for stream in streams:
+                    # Stream large data from file into sector
+                    if stream.stat().st_size >= MINI_STREAM_CUTOFF_SIZE:
+                        with open(stream.path, "rb", buffering=0) as f:
+                            # Hint kernel to read ahead whole file eagerly
+                            if hasattr(os, "posix_fadvise"):
+                                os.posix_fadvise(
+                                    f.fileno(),
+                                    0,
+                                    0,
+                                    os.POSIX_FADV_SEQUENTIAL,
+                                )
+
+                            stream_sector_index, stream_size = (
+                                cfb.write_sector_from_file(f)
+                            )
+
+                        # Move file shrunk since scan into mini-sector
+                        if stream_size < MINI_STREAM_CUTOFF_SIZE:
+                            offset = stream_sector_index * cfb.sector_size
+                            stream_data = cfb.sectors[
+                                offset : offset + stream_size
+                            ]
+
+                            cfb.discard_sectors(stream_sector_index)
+                            stream_sector_index = cfb.write_mini_sector(
+                                stream_data,
+                            )
+
+                    # Take small data read ahead or read in place
+                    else:
+                        stream_data = next(small_data)
+                        stream_size = len(stream_data)
+
+                        # Write file grown since scan into sector
+                        if stream_size >= MINI_STREAM_CUTOFF_SIZE:
+                            stream_sector_index = cfb.write_sector(
+                                stream_data,
+                            )
+
+                        # Write small data into mini-sector
+                        else:
+                            stream_sector_index = cfb.write_mini_sector(
+                                stream_data,
+                            )
+
+                    # Insert stream into directory with size actually read
+                    cfb.insert_entry(
+                        storage_entries[storage],
+                        directory.EntryData(
+                            name=stream.name,
+                            obj_type=directory.OBJTY_STREAM,
+                            sector=stream_sector_index,
+                            size=stream_size,
+                        ),
+                    )
+
+        # Write mini-sector into sector straight from mini-sector buffer
+        mini_sector_index = cfb.write_sector(cfb.mini_sectors)
+
+        cfb.root_directory.root.data.size = len(cfb.mini_sectors)
+        cfb.root_directory.root.data.sector = mini_sector_index
 
         # Write mini-fat into sector
-        mini_fat_data = b"".join(
-            [struct.pack("<I", entry) for entry in cfb.mini_fat],
-        )
-        cfb.num_mini_fat_sectors = math.ceil(
-            len(mini_fat_data) / sector_size,
+        mini_fat_data = _pack_entries(cfb.mini_fat)
+        cfb.num_mini_fat_sectors = _count_sectors(
+            len(mini_fat_data),
+            cfb.sector_shift,
         )
         cfb.first_mini_fat_sector = cfb.write_sector(mini_fat_data)
 
-        # Round up to nearest multiple of 4
-        directory_list = [b"\xff\xff\xff\xff"] * ((cfb.num_dir + 3) // 4) * 4
+        # Round up to nearest multiple of 4 and fill with empty entries
+        num_entries = (cfb.num_dir + 3) // 4 * 4
+        directory_data = bytearray(directory.EMPTY_ENTRY) * num_entries
 
-        # Insert directory entry into directory list
-        for entry in cfb.root_directory.traverse():
-            directory_list[entry.stream_id()] = bytes(entry)
+        # Pack directory entry into its slot of directory data
+        cfb.root_directory.pack_into(directory_data)
 
         # Write directory entry into sector
-        directory_data = b"".join(directory_list)
-        cfb.num_dir_sectors = math.ceil(len(directory_data) / sector_size)
+        cfb.num_dir_sectors = _count_sectors(
+            len(directory_data),
+            cfb.sector_shift,
+        )
         cfb.first_dir_sector = cfb.write_sector(directory_data)
 
-        # Write fat into sector
-        fat_data = b"".join([struct.pack("<I", entry) for entry in cfb.fat])
-        cfb.write_fat(fat_data)
-        cfb.num_fat_sectors = math.ceil(len(fat_data) / sector_size)
+        # Write fat and difat into sector
+        cfb.write_fat()
 
         # Hotfixed instance variables
         # TODO: You have to remove this line after problem is fully recognized.
-        cfb.first_difat_sector = 0xFFFFFFFE
         cfb.num_dir_sectors = 0
 
         # Export results as file
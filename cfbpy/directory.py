@@ -19,8 +19,71 @@ OBJTY_ROOT = 0x05  #: element is a root storage
 RED = 0x00
 BLACK = 0x01
 
+# Precompiled struct format of directory entry
+_DIR_ENTRY = struct.Struct("<64sHBBIII16sIQQIQ")
+ENTRY_SIZE = _DIR_ENTRY.size  #: size of directory entry in bytes
+
+# Unallocated directory entry
+EMPTY_ENTRY = _DIR_ENTRY.pack(
+    b"",
+    0,
+    OBJTY_EMPTY,
+    RED,
+    NOSTREAM,
+    NOSTREAM,
+    NOSTREAM,
+    bytes(16),
+    0x00000000,
+    0x0000000000000000,
+    0x0000000000000000,
+    0x00000000,
+    0x0000000000000000,
+)
+
+
+def unpack_entry(buffer, offset):
+    """
+    Unpack directory entry from `buffer` starting at `offset`.
+
+    Returns name, object type, stream IDs of left sibling, right sibling and child, starting sector and stream size.
+
+    """
+
+    (
+        name,
+        name_length,
+        obj_type,
+        _,
+        left,
+        right,
+        child,
+        _,
+        _,
+        _,
+        _,
+        sector,
+        size,
+    ) = _DIR_ENTRY.unpack_from(buffer, offset)
+
+    # Name length counts terminating null. Broken surrogate is replaced.
+    name = name[: max(name_length - 2, 0)].decode("utf-16-le", "replace")
+
+    return name, obj_type, left, right, child, sector, size
+
 
 class EntryData:
+    __slots__ = (
+        "name",
+        "name_length",
+        "stream_id",
+        "obj_type",
+        "sector",
+        "size",
+        "parent",
+        "child",
+        "_sort_key",
+    )
+
     def __init__(
         self,
         name: str,
@@ -32,7 +95,19 @@ class EntryData:
     ):
 
         # Entry information
-        self.name = name[:31].encode("utf-16-le")
+        # Name is limited to 31 UTF-16 code units plus terminating null
+        self.name = name[:31].encode("utf-16-le")[:62]
+
+        # Drop high surrogate left alone by cutting surrogate pair in half
+        if len(self.name) == 62 and 0xD8 <= self.name[61] <= 0xDB:
+            self.name = self.name[:60]
+
+        self.name_length = len(self.name) + 2
+
+        # Key for comparison, computed once as entries are compared often.
+        # Key is computed from name as stored, which may have been cut.
+        upper_name = self.name.decode("utf-16-le").upper()
+        self._sort_key = (self.name_length, upper_name)
         self.stream_id = stream_id
         self.obj_type = obj_type
         self.sector = sector
@@ -58,18 +133,16 @@ class EntryData:
 
         However, as MS-CFB has some exception cases for several unicode characters. But this exceptions are negligible. Who will use "LATIN SMALL LETTER A WITH STROKE" for directory name?
 
-        """
-
-        self_name = self.name.decode("utf-16-le").upper()
-        other_name = other.name.decode("utf-16-le").upper()
+        Uppercase name and its length are cached as sort key on construction, so comparison does not decode name.
 
-        if len(self_name) != len(other_name):
-            return len(self_name) > len(other_name)
+        """
 
-        return self_name > other_name
+        return self._sort_key > other._sort_key
 
 
 class Entry:
+    __slots__ = ("data", "color", "left", "right", "parent")
+
     def __init__(
         self,
         data: EntryData = None,
@@ -92,10 +165,23 @@ class Entry:
         Represents directory entry objects as 128-byte bytes string.
 
         """
-        directory_data = struct.pack(
-            "<64sHBBIII16sIQQIQ",
+
+        directory_data = bytearray(ENTRY_SIZE)
+        self.pack_into(directory_data, 0)
+
+        return bytes(directory_data)
+
+    def pack_into(self, buffer, offset):
+        """
+        Pack directory entry into writable `buffer` starting at `offset`.
+
+        """
+
+        _DIR_ENTRY.pack_into(
+            buffer,
+            offset,
             self.data.name,
-            len(self.data.name) + 2,
+            self.data.name_length,
             self.data.obj_type,
             self.color,
             self.left.stream_id(),
@@ -109,8 +195,6 @@ class Entry:
             self.data.size,
         )
 
-        return directory_data
-
     def stream_id(self):
         """
         Get `stream_id` from entry data
@@ -125,25 +209,29 @@ class Entry:
         return self.data.stream_id
 
 
+# Sentinel entry shared by every directory for indicating there's no entry.
+# NIL is black and links to itself, so root entry has NIL as its parent.
+NIL = Entry(color=BLACK)
+NIL.left = NIL.right = NIL.parent = NIL
+
+
 class Directory:
     def __init__(self):
         """
         Initialize Directory
 
-        Create NIL entry for indicating there's no entry available.
-        Set root as NIL.
+        Set root as shared NIL entry.
 
         """
 
-        self.NIL = Entry(color=BLACK)
-        self.root = self.NIL
+        self.root = NIL
 
     def insert(self, data: EntryData):
-        new_entry = Entry(data=data, left=self.NIL, right=self.NIL)
-        parent = None
+        new_entry = Entry(data=data, left=NIL, right=NIL)
+        parent = NIL
         current = self.root
 
-        while current != self.NIL:
+        while current is not NIL:
             parent = current
 
             if new_entry.data < current.data:
@@ -155,7 +243,7 @@ class Directory:
         new_entry.parent = parent
 
         # Tree is empty
-        if parent is None:
+        if parent is NIL:
             self.root = new_entry
 
         elif new_entry.data < parent.data:
@@ -164,98 +252,108 @@ class Directory:
         else:
             parent.right = new_entry
 
-        new_entry.left = self.NIL
-        new_entry.right = self.NIL
+        new_entry.left = NIL
+        new_entry.right = NIL
         new_entry.color = RED
 
         self.fix_insert(new_entry)
 
+        return new_entry
+
     def fix_insert(self, entry):
-        while entry.parent and entry.parent.color == RED:
-            if entry.parent == entry.parent.parent.left:
-                uncle = entry.parent.parent.right
+        while (parent := entry.parent).color == RED:
+            grandparent = parent.parent
+
+            if parent is grandparent.left:
+                uncle = grandparent.right
 
                 # Case 1: Uncle is red
                 if uncle.color == RED:
-                    entry.parent.color = BLACK
+                    parent.color = BLACK
                     uncle.color = BLACK
-                    entry.parent.parent.color = RED
-                    entry = entry.parent.parent
+                    grandparent.color = RED
+                    entry = grandparent
 
                 else:
                     # Case 2: entry is right child
-                    if entry == entry.parent.right:
-                        entry = entry.parent
+                    if entry is parent.right:
+                        entry = parent
                         self.left_rotate(entry)
+                        parent = entry.parent
 
                     # Case 3: entry is left child
-                    entry.parent.color = BLACK
-                    entry.parent.parent.color = RED
-                    self.right_rotate(entry.parent.parent)
+                    parent.color = BLACK
+                    grandparent.color = RED
+                    self.right_rotate(grandparent)
 
             else:
-                uncle = entry.parent.parent.left
+                uncle = grandparent.left
 
                 # Case 1: Uncle is red
                 if uncle.color == RED:
-                    entry.parent.color = BLACK
+                    parent.color = BLACK
                     uncle.color = BLACK
-                    entry.parent.parent.color = RED
-                    entry = entry.parent.parent
+                    grandparent.color = RED
+                    entry = grandparent
 
                 else:
                     # Case 2: entry is left child
-                    if entry == entry.parent.left:
-                        entry = entry.parent
+                    if entry is parent.left:
+                        entry = parent
                         self.right_rotate(entry)
+                        parent = entry.parent
 
                     # Case 3: entry is right child
-                    entry.parent.color = BLACK
-                    entry.parent.parent.color = RED
-                    self.left_rotate(entry.parent.parent)
+                    parent.color = BLACK
+                    grandparent.color = RED
+                    self.left_rotate(grandparent)
 
         self.root.color = BLACK
 
     def left_rotate(self, entry):
         right_child = entry.right
-        entry.right = right_child.left
+        parent = entry.parent
+
+        entry.right = grandchild = right_child.left
 
-        if right_child.left != self.NIL:
-            right_child.left.parent = entry
+        if grandchild is not NIL:
+            grandchild.parent = entry
 
-        right_child.parent = entry.parent
+        right_child.parent = parent
 
         # entry is root
-        if entry.parent is None:
+        if parent is NIL:
             self.root = right_child
 
-        elif entry == entry.parent.left:
-            entry.parent.left = right_child
+        elif entry is parent.left:
+            parent.left = right_child
 
         else:
-            entry.parent.right = right_child
+            parent.right = right_child
 
         right_child.left = entry
         entry.parent = right_child
 
     def right_rotate(self, entry):
         left_child = entry.left
-        entry.left = left_child.right
+        parent = entry.parent
 
-        if left_child.right != self.NIL:
-            left_child.right.parent = entry
+        entry.left = grandchild = left_child.right
 
-        left_child.parent = entry.parent
+        if grandchild is not NIL:
+            grandchild.parent = entry
+
+        left_child.parent = parent
 
         # entry is root
-        if entry.parent is None:
+        if parent is NIL:
             self.root = left_child
 
-        elif entry == entry.parent.right:
-            entry.parent.right = left_child
+        elif entry is parent.right:
+            parent.right = left_child
 
         else:
-            entry.parent.left = left_child
+            parent.left = left_child
 
         left_child.right = entry
         entry.parent = left_child
@@ -272,27 +370,61 @@ class Directory:
         return self._search_tree_helper(self.root, name_entry_data)
 
     def _search_tree_helper(self, entry, data):
-        if entry == self.NIL or data == entry.data:
-            return entry
-
-        if data < entry.data:
-            return self._search_tree_helper(entry.left, data)
+        while entry is not NIL and data != entry.data:
+            entry = entry.left if data < entry.data else entry.right
 
-        return self._search_tree_helper(entry.right, data)
+        return entry
 
     def traverse(self, entry=None):
         """
         Traverse directory tree
 
+        Entries are yielded in order, each followed by entries of its child directory. Tree is walked with explicit stack instead of recursion.
+
         """
 
         if entry == None:
             entry = self.root
 
-        if entry != self.NIL:
-            yield from self.traverse(entry.left)
+        # Stack of subtrees to walk and entries to yield (marked with `True`)
+        stack = [(entry, False)]
+
+        while stack:
+            entry, visited = stack.pop()
+
+            # Skip NIL entry
+            if entry is NIL:
+                continue
+
+            if visited:
+                yield entry
+                continue
+
+            # Push in reverse order of visit
+            stack.append((entry.right, False))
+            stack.append((entry.data.child.root, False))
+            stack.append((entry, True))
+            stack.append((entry.left, False))
+
+    def pack_into(self, buffer):
+        """
+        Pack every entry of directory tree into writable `buffer`.
+
+        Each entry is packed at slot of its stream ID. Tree is walked in the same way as `traverse` without yielding entries one by one.
+
+        """
+
+        stack = [self.root]
+
+        while stack:
+            entry = stack.pop()
+
+            # Skip NIL entry
+            if entry is NIL:
+                continue
 
-            yield entry
-            yield from entry.data.child.traverse()
+            entry.pack_into(buffer, entry.data.stream_id * ENTRY_SIZE)
 
-            yield from self.traverse(entry.right)
+            stack.append(entry.right)
+            stack.append(entry.data.child.root)
+            stack.append(entry.left)
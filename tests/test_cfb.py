@@ -0,0 +1,251 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from cfbpy import CompoundFile, MINI_STREAM_CUTOFF_SIZE
+
+
+class CompoundFileTest(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+
+        self.src = os.path.join(self.temp_dir.name, "src")
+        self.cfb = os.path.join(self.temp_dir.name, "src.cfb")
+        self.dest = os.path.join(self.temp_dir.name, "dest")
+
+    def make_tree(self, tree):
+        """
+        Create directory tree at `src` from dict of relative path and file data.
+
+        Path ending with slash is created as empty directory.
+
+        """
+
+        os.makedirs(self.src)
+
+        for path, data in tree.items():
+            full_path = os.path.join(self.src, *path.split("/"))
+
+            if path.endswith("/"):
+                os.makedirs(full_path, exist_ok=True)
+                continue
+
+            os.makedirs(os.path.dirname(full_path), exist_ok=True)
+
+            with open(full_path, "wb") as f:
+                f.write(data)
+
+    def read_tree(self, root):
+        """
+        Read directory tree at `root` in the same form as `make_tree`.
+
+        """
+
+        tree = {}
+
+        for dir_path, dir_names, file_names in os.walk(root):
+            path = os.path.relpath(dir_path, root).replace(os.sep, "/")
+            prefix = "" if path == "." else f"{path}/"
+
+            if not dir_names and not file_names and prefix:
+                tree[prefix] = None
+
+            for file_name in file_names:
+                with open(os.path.join(dir_path, file_name), "rb") as f:
+                    tree[prefix + file_name] = f.read()
+
+        return tree
+
+    def round_trip(self, tree):
+        self.make_tree(tree)
+
+        CompoundFile.compress(self.src, self.cfb)
+        CompoundFile.decompress(self.cfb, self.dest)
+
+        return self.read_tree(self.dest)
+
+    def test_round_trip_stream_sizes(self):
+        sizes = [
+            0,
+            1,
+            63,
+            64,
+            65,
+            511,
+            512,
+            513,
+            MINI_STREAM_CUTOFF_SIZE - 1,
+            MINI_STREAM_CUTOFF_SIZE,
+            MINI_STREAM_CUTOFF_SIZE + 1,
+            (1 << 20) + 7,
+        ]
+        tree = {f"stream{size}": os.urandom(size) for size in sizes}
+
+        self.assertEqual(self.round_trip(tree), tree)
+
+    def test_round_trip_difat_sectors(self):
+        # Header lists up to 109 fat sectors, about 7 MB of sectors
+        tree = {
+            "large": os.urandom(8 << 20),
+            "storage/small": os.urandom(100),
+        }
+
+        self.assertEqual(self.round_trip(tree), tree)
+
+    def test_round_trip_storages(self):
+        tree = {
+            "top": b"top",
+            "a/b/c/deep": os.urandom(MINI_STREAM_CUTOFF_SIZE),
+            "a/b/small": os.urandom(100),
+            "a/empty/": None,
+            "empty/": None,
+            "zero/nested/": None,
+            "zero/file": b"",
+        }
+
+        self.assertEqual(self.round_trip(tree), tree)
+
+    def test_round_trip_many_entries(self):
+        tree = {
+            f"dir{i % 7}/file{i}": os.urandom(i * 37 % 5000)
+            for i in range(300)
+        }
+
+        self.assertEqual(self.round_trip(tree), tree)
+
+    def test_round_trip_read_ahead(self):
+        # Small streams are read ahead on thread pool with several CPUs
+        tree = {
+            f"dir{i % 3}/file{i}": os.urandom(i * 53 % 6000)
+            for i in range(200)
+        }
+
+        with mock.patch("os.cpu_count", return_value=4):
+            self.assertEqual(self.round_trip(tree), tree)
+
+    def test_round_trip_long_names(self):
+        # Names are cut to 31 UTF-16 code units without splitting pairs
+        tree = {
+            "a" * 40: b"ascii",
+            "\U0001d518" * 20: b"astral",
+            "b" + "\U0001d518" * 20: b"astral after ascii",
+        }
+
+        self.assertEqual(
+            self.round_trip(tree),
+            {
+                "a" * 31: b"ascii",
+                "\U0001d518" * 15: b"astral",
+                "b" + "\U0001d518" * 15: b"astral after ascii",
+            },
+        )
+
+    def test_decompress_broken_surrogate_name(self):
+        self.make_tree({"ab": b"data"})
+        CompoundFile.compress(self.src, self.cfb)
+
+        with open(self.cfb, "rb") as f:
+            data = f.read()
+
+        # Replace "a" of stream name with lone high surrogate
+        name = "ab".encode("utf-16-le") + b"\x00\x00"
+        self.assertEqual(data.count(name), 1)
+        data = data.replace(name, b"\x00\xd8b\x00\x00\x00")
+
+        with open(self.cfb, "wb") as f:
+            f.write(data)
+
+        CompoundFile.decompress(self.cfb, self.dest)
+
+        self.assertEqual(self.read_tree(self.dest), {"\ufffdb": b"data"})
+
+    def test_decompress_error_after_written_stream(self):
+        self.make_tree({"first": b"first", "second": b"second"})
+        CompoundFile.compress(self.src, self.cfb)
+
+        # Either stream may be written first, so block each one in turn
+        for name in ("first", "second"):
+            with self.subTest(name=name):
+                dest = os.path.join(self.temp_dir.name, f"dest_{name}")
+                os.makedirs(os.path.join(dest, name))
+
+                with self.assertRaises(OSError):
+                    CompoundFile.decompress(self.cfb, dest)
+
+    def test_decompress_corrupt_input(self):
+        self.make_tree(
+            {
+                "large": os.urandom(100000),
+                "small": os.urandom(100),
+            },
+        )
+        CompoundFile.compress(self.src, self.cfb)
+
+        with open(self.cfb, "rb") as f:
+            data = f.read()
+
+        def patch_entry(name, offset, value):
+            """
+            Patch u32 field at `offset` of directory entry named `name`.
+
+            """
+
+            position = data.index(name.encode("utf-16-le") + b"\x00\x00")
+            position += offset
+
+            return b"".join(
+                (
+                    data[:position],
+                    value.to_bytes(4, "little"),
+                    data[position + 4 :],
+                ),
+            )
+
+        corrupt_data = {
+            "signature": (
+                b"\x00" * 8 + data[8:],
+                "Given file is not a compound file",
+            ),
+            "header only": (
+                data[:100],
+                "Given file is not a compound file",
+            ),
+            "truncated": (
+                data[: len(data) // 2],
+                "Stream runs past end of compound file",
+            ),
+            "sector outside fat": (
+                patch_entry("large", 116, 0x00FFFFFF),
+                "Stream runs past end of compound file",
+            ),
+            "size beyond chain": (
+                patch_entry("large", 120, 200000),
+                "Stream is longer than its sector chain",
+            ),
+            "mini sector outside mini stream": (
+                patch_entry("small", 116, 100),
+                "Stream is longer than its sector chain",
+            ),
+            "child outside directory": (
+                patch_entry("Root Entry", 76, 1000),
+                "Stream ID runs past end of directory",
+            ),
+        }
+
+        for case, (corrupt, message) in corrupt_data.items():
+            with self.subTest(case=case):
+                path = os.path.join(self.temp_dir.name, "corrupt.cfb")
+
+                with open(path, "wb") as f:
+                    f.write(corrupt)
+
+                with self.assertRaisesRegex(Exception, message) as context:
+                    CompoundFile.decompress(path, self.dest)
+
+                self.assertIs(type(context.exception), Exception)
+
+
+if __name__ == "__main__":
+    unittest.main()